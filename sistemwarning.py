@@ -1,8 +1,16 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import numba
 import plotly.express as px  # Untuk visualisasi interaktif
+import io
+import hashlib
+import itertools
 import os
+import concurrent.futures
+import multiprocessing
+from python_calamine import CalamineWorkbook
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 # ---------------------------
 # Konstanta Utama
@@ -10,99 +18,220 @@ import os
 PV_CAPACITY = 2.06               # MWp (kapasitas PV plant)
 PR_THRESHOLD = 0.75              # Batas Performance Ratio
 INVERTER_EFF_THRESHOLD = 0.90    # Batas efisiensi Inverter
+SHEET_NAME = '5 minutes'         # Nama sheet data 5 menit
+SKIP_ROWS = 4                    # Baris judul/metadata + header sebelum data
+START_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # Format teks kolom 'Start Time'
+MAX_INVERTER_WORKERS = 8         # Batas thread analisis inverter paralel
+PARALLEL_LOAD_MIN_BYTES = 8 * 1024 * 1024  # Total ukuran file inverter minimal untuk load paralel
+PR_PLOT_FREQ = '1h'              # Resolusi grafik PR vs. waktu (rata-rata per jam)
+
+# Kunci cache file upload (nama, ukuran, isi), supaya rerun Streamlit
+# tidak mem-parsing ulang file Excel yang sama
+UPLOAD_HASH_FUNCS = {UploadedFile: lambda f: (f.name, f.size, f.getvalue())}
+
+# Kode hasil klasifikasi PR (lihat classify_pr_kernel):
+# 0 = Good, 1 = Kalibrasi Sensor, 2 = Kotoran Modul, 3 = tanpa irradiance (PR NaN)
+STATUS_LABELS = ['Needs Attention', 'Good']
+ISSUE_LABELS = ['Tidak Ada Masalah', 'Kalibrasi Sensor Dibutuhkan', 'Kotoran Modul']
+ISSUE_CODE_MAP = np.array([0, 1, 2, 0], dtype=np.int8)
 
 # ==================================================
 # Fungsi-Fungsi Bantuan (Sama seperti contoh sebelumnya)
 # ==================================================
+def parse_start_time(start_time):
+    """
+    Konversi kolom 'Start Time' ke datetime. Coba format tetap dulu (cepat);
+    jika tidak ada satu pun yang cocok, parsing ulang tanpa format.
+    """
+    parsed = pd.to_datetime(start_time, format=START_TIME_FORMAT, errors='coerce', cache=True)
+    if len(start_time) and parsed.isna().all():
+        parsed = pd.to_datetime(start_time, errors='coerce', cache=True)
+        if parsed.isna().all():
+            raise ValueError(
+                f"Kolom 'Start Time' tidak bisa dibaca sebagai tanggal/waktu "
+                f"(contoh nilai: {start_time.iloc[0]!r})."
+            )
+    return parsed
+
+def index_by_start_time(df, value_column):
+    """
+    Ambil kolom 'Start Time' & kolom nilai, lalu jadikan 'Start Time'
+    index yang terurut dan unik (siap untuk join berbasis index).
+    """
+    df = df.dropna(subset=['Start Time'])
+    if df.empty:
+        raise ValueError(f"Tidak ada baris data '{value_column}' yang valid di sheet '{SHEET_NAME}'.")
+    df = df[['Start Time', value_column]].set_index('Start Time').sort_index()
+    return df[~df.index.duplicated(keep='first')]
+
+def read_sheet_columns(file, time_col, value_col, value_name):
+    """
+    Baca kolom waktu & satu kolom nilai dari sheet data baris demi baris
+    (python-calamine), tanpa membuat DataFrame untuk seluruh kolom sheet.
+    """
+    sheet = CalamineWorkbook.from_filelike(file).get_sheet_by_name(SHEET_NAME)
+    if sheet.start is None:
+        raise ValueError(f"Sheet '{SHEET_NAME}' kosong.")
+    # iter_rows mulai dari area sheet yang terisi, bukan selalu dari A1
+    first_row, first_col = sheet.start
+    rows = itertools.islice(sheet.iter_rows(), max(SKIP_ROWS - first_row, 0), None)
+    time_idx, value_idx = time_col - first_col, value_col - first_col
+    pairs = [(row[time_idx], row[value_idx]) for row in rows]
+    return pd.DataFrame(pairs, columns=['Start Time', value_name])
+
+def load_sheet_values(file, value_col, value_name):
+    """
+    Baca kolom waktu (kolom ke-4) & satu kolom nilai dari file Excel,
+    buang nilai yang tidak valid, lalu kembalikan DataFrame float32
+    berindex 'Start Time'.
+    """
+    df = read_sheet_columns(file, 3, value_col, value_name)
+
+    # Satu mask: nilai valid (bukan NaN/inf) dan tidak negatif
+    values = pd.to_numeric(df[value_name], errors='coerce').to_numpy(np.float32)
+    mask = np.isfinite(values) & (values >= 0)
+    df = df.loc[mask].copy()
+    df['Start Time'] = parse_start_time(df['Start Time'])
+    df[value_name] = values[mask]
+
+    return index_by_start_time(df, value_name)
+
+@st.cache_data(show_spinner=False, hash_funcs=UPLOAD_HASH_FUNCS)
 def load_sensor_data_em(file_em):
     """
-    Membaca file Excel EM, mengatur kolom secara dinamis,
-    dan memproses data agar siap dipakai.
+    Membaca file Excel EM (kolom waktu & irradiance).
     """
-    df_em = pd.ExcelFile(file_em).parse('5 minutes')
-    em_columns = df_em.iloc[2].tolist()
-    
-    df_em.columns = em_columns
-    df_em = df_em.iloc[3:].rename(columns={
-        em_columns[3]: 'Start Time',
-        em_columns[4]: 'Irradiance'
-    })
-    
-    df_em['Irradiance'] = pd.to_numeric(df_em['Irradiance'], errors='coerce')
-    df_em = df_em.dropna(subset=['Irradiance'])
-    df_em = df_em[df_em['Irradiance'] >= 0]
-    
-    return df_em
+    return load_sheet_values(file_em, 4, 'Irradiance')
 
+@st.cache_data(show_spinner=False, hash_funcs=UPLOAD_HASH_FUNCS)
 def load_revenue_meter_data_rm(file_rm):
     """
-    Membaca file Excel RM, mengatur kolom secara dinamis,
-    dan memproses data agar siap dipakai.
+    Membaca file Excel RM (kolom waktu & active energy).
     """
-    df_rm = pd.ExcelFile(file_rm).parse('5 minutes')
-    rm_columns = df_rm.iloc[2].tolist()
-    
-    df_rm.columns = rm_columns
-    df_rm = df_rm.iloc[3:].rename(columns={
-        rm_columns[3]: 'Start Time',
-        rm_columns[5]: 'Active Energy (kWh)'
-    })
-    
-    df_rm['Active Energy (kWh)'] = pd.to_numeric(df_rm['Active Energy (kWh)'], errors='coerce')
-    df_rm = df_rm.dropna(subset=['Active Energy (kWh)'])
-    df_rm = df_rm[df_rm['Active Energy (kWh)'] >= 0]
-    
-    return df_rm
+    return load_sheet_values(file_rm, 5, 'Active Energy (kWh)')
+
+def upload_digest(*contents):
+    """
+    Sidik jari (sha256) isi beberapa file upload, dipakai sebagai kunci
+    cache hasil analisis pengganti hashing DataFrame.
+    """
+    digest = hashlib.sha256()
+    for data in contents:
+        # Panjang ikut di-hash supaya batas antar file tidak ambigu
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
 
-def calculate_performance_ratio(df_em, df_rm, pv_capacity=PV_CAPACITY, threshold=PR_THRESHOLD):
+# Tanpa parallel=True: kernel dipanggil dari thread sesi Streamlit yang bisa
+# berjalan bersamaan, dan threading layer workqueue numba tidak thread-safe
+@numba.njit(cache=True)
+def classify_pr_kernel(irr, active, threshold, pv_capacity_w):
     """
-    Menggabungkan data EM & RM, hitung PR, dan memberi label performa.
+    Hitung PR dan kode klasifikasinya per baris dalam satu loop.
     """
-    merged_df = pd.merge(df_em, df_rm, on='Start Time', how='inner')
-    merged_df['PR'] = merged_df['Active Energy (kWh)'] / (merged_df['Irradiance'] * pv_capacity * 1000)
-    merged_df['Performance Status'] = merged_df['PR'].apply(
-        lambda x: 'Good' if x >= threshold else 'Needs Attention'
+    n = irr.shape[0]
+    pr = np.empty(n, np.float32)
+    code = np.empty(n, np.int8)
+    for i in range(n):
+        if irr[i] > 0:
+            # Klasifikasi memakai nilai float32 yang sama dengan kolom PR
+            p = np.float32(active[i] / (irr[i] * pv_capacity_w))
+            pr[i] = p
+            if p >= threshold:
+                code[i] = 0
+            elif p >= threshold * 0.9:
+                code[i] = 1
+            else:
+                code[i] = 2
+        else:
+            # Irradiance 0 (malam hari) -> PR NaN
+            pr[i] = np.nan
+            code[i] = 3
+    return pr, code
+
+def describe_pr(pr):
+    """
+    Statistik PR seperti Series.describe(), dihitung langsung dari array
+    (nilai NaN dari interval tanpa irradiance diabaikan).
+    """
+    labels = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+    pr = pr[np.isfinite(pr)].astype(np.float64)
+    if pr.size == 0:
+        return pd.Series([0] + [np.nan] * 7, index=labels, name='PR')
+
+    # min, kuartil, dan max diambil dari satu kali partisi
+    pr_min, q25, q50, q75, pr_max = np.quantile(pr, [0, 0.25, 0.5, 0.75, 1])
+    std = pr.std(ddof=1) if pr.size > 1 else np.nan
+    return pd.Series([pr.size, pr.mean(), std, pr_min, q25, q50, q75, pr_max],
+                     index=labels, name='PR')
+
+# Parameter berawalan '_' tidak di-hash Streamlit (DataFrame besar hanya
+# di-hash dari sampel baris, jadi hasil cache bisa basi); kunci cache
+# diambil dari source_digest, yaitu upload_digest isi file sumbernya
+@st.cache_data(show_spinner=False, max_entries=4)
+def compute_pr_and_issues(_df_em, _df_rm, source_digest, pv_capacity=PV_CAPACITY, threshold=PR_THRESHOLD):
+    """
+    Menggabungkan data EM & RM, hitung PR, beri label performa,
+    dan identifikasi masalah jika PR < threshold (dalam satu kali proses).
+    """
+    # Join berbasis index 'Start Time' (sudah terurut dari loader)
+    merged_df = _df_em.join(_df_rm, how='inner').reset_index()
+    irr = merged_df['Irradiance'].to_numpy(np.float32)
+    active = merged_df['Active Energy (kWh)'].to_numpy(np.float32)
+
+    pr, code = classify_pr_kernel(irr, active, float(threshold), float(pv_capacity) * 1000.0)
+
+    merged_df['PR'] = pr
+    merged_df['Performance Status'] = pd.Categorical.from_codes(
+        (code == 0).astype(np.int8), categories=STATUS_LABELS
+    )
+    merged_df['Indikasi Masalah'] = pd.Categorical.from_codes(
+        ISSUE_CODE_MAP[code], categories=ISSUE_LABELS
     )
     return merged_df
 
-def identify_performance_issues(df, threshold=PR_THRESHOLD):
+def summarize_inverter(inv_data, inv_file_name, sim_index, simulated, eff_threshold=INVERTER_EFF_THRESHOLD):
     """
-    Identifikasi masalah performa jika PR < threshold.
+    Hitung ringkasan efisiensi satu inverter terhadap simulated energy
+    bersama (array, selaras dengan sim_index 'Start Time').
     """
-    def check_issue(row):
-        if row['PR'] < threshold:
-            if row['PR'] < threshold * 0.9:
-                return 'Kotoran Modul'
-            else:
-                return 'Kalibrasi Sensor Dibutuhkan'
-        return 'Tidak Ada Masalah'
-    
-    df['Indikasi Masalah'] = df.apply(check_issue, axis=1)
-    return df
+    # Selaraskan ke index simulated; waktu tanpa data inverter -> NaN
+    energy_out = inv_data['Energy Output (kWh)'].reindex(sim_index).to_numpy()
+    # simulated selalu > 0; NaN dari data yang hilang dibuang sekali,
+    # lalu hitungan & rata-rata memakai array yang sama
+    eff = energy_out / simulated
+    valid = eff[~np.isnan(eff)]
+
+    return {
+        'Inverter File': inv_file_name,
+        'Low Efficiency Count': np.count_nonzero(valid < eff_threshold),
+        'Mean Efficiency': valid.mean() if valid.size else np.nan
+    }
 
-def analyze_inverter_performance(merged_df, inverter_df_list, pv_capacity=PV_CAPACITY,
+# Sama seperti compute_pr_and_issues: kunci cache dari source_digest,
+# bukan dari isi DataFrame
+@st.cache_data(show_spinner=False, max_entries=4)
+def analyze_inverter_performance(_merged_df, _inverter_df_list, source_digest, pv_capacity=PV_CAPACITY,
                                  eff_threshold=INVERTER_EFF_THRESHOLD):
     """
     Menganalisis performa beberapa inverter dengan data frame
     (sudah di-load di memori, bukan file).
     """
-    results = []
-    for inv_data, inv_file_name in inverter_df_list:
-        # Pastikan kolom sesuai
-        df_merged_inv = pd.merge(merged_df, inv_data, on='Start Time', how='inner')
-        
-        # Simulated energy
-        df_merged_inv['Simulated Energy (kWh)'] = df_merged_inv['Irradiance'] * pv_capacity * 1000
-        
-        df_merged_inv = df_merged_inv[df_merged_inv['Simulated Energy (kWh)'] > 0]
-        df_merged_inv['Inverter Efficiency'] = df_merged_inv['Energy Output (kWh)'] / df_merged_inv['Simulated Energy (kWh)']
-        
-        low_eff_df = df_merged_inv[df_merged_inv['Inverter Efficiency'] < eff_threshold]
-        results.append({
-            'Inverter File': inv_file_name,
-            'Low Efficiency Count': len(low_eff_df),
-            'Mean Efficiency': df_merged_inv['Inverter Efficiency'].mean()
-        })
+    # Simulated energy hanya bergantung pada irradiance, jadi dihitung
+    # (dan difilter > 0) sekali untuk semua inverter
+    irradiance = _merged_df.set_index('Start Time').sort_index()['Irradiance']
+    simulated = irradiance.to_numpy(np.float32) * (pv_capacity * 1000.0)
+    mask = simulated > 0
+    sim_index, simulated = irradiance.index[mask], simulated[mask]
+
+    # Tiap inverter independen (simulated hanya dibaca), jadi bisa diproses
+    # paralel; operasi numerik pandas melepas GIL sehingga thread cukup
+    max_workers = max(1, min(MAX_INVERTER_WORKERS, len(_inverter_df_list)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda item: summarize_inverter(item[0], item[1], sim_index, simulated, eff_threshold),
+            _inverter_df_list
+        ))
     
     summary_df = pd.DataFrame(results)
     return summary_df
@@ -110,21 +239,35 @@ def analyze_inverter_performance(merged_df, inverter_df_list, pv_capacity=PV_CAP
 def load_inverter_data(file):
     """
     Load data inverter dari file Excel,
-    lalu kembalikan DataFrame dengan kolom
-    'Start Time' dan 'Energy Output (kWh)'.
-    """
-    inv_data = pd.ExcelFile(file).parse('5 minutes')
-    inv_columns = inv_data.iloc[2].tolist()
-    inv_data.columns = inv_columns
-    inv_data = inv_data.iloc[3:].rename(columns={
-        inv_columns[3]: 'Start Time',
-        inv_columns[5]: 'Energy Output (kWh)'
-    })
-    
-    inv_data['Energy Output (kWh)'] = pd.to_numeric(inv_data['Energy Output (kWh)'], errors='coerce')
-    inv_data = inv_data.dropna(subset=['Energy Output (kWh)'])
-    inv_data = inv_data[inv_data['Energy Output (kWh)'] >= 0]
-    return inv_data
+    lalu kembalikan DataFrame berindex 'Start Time'
+    dengan kolom 'Energy Output (kWh)'.
+    """
+    return load_sheet_values(file, 5, 'Energy Output (kWh)')
+
+def load_inverter_data_bytes(data):
+    """
+    Sama seperti load_inverter_data, tetapi dari isi file (bytes)
+    supaya argumennya bisa di-pickle ke proses lain.
+    """
+    return load_inverter_data(io.BytesIO(data))
+
+@st.cache_data(show_spinner=False)
+def load_inverter_files(inverter_contents):
+    """
+    Load banyak file inverter sekaligus (tuple berisi bytes tiap file).
+    File besar diproses di proses terpisah; untuk file kecil biaya start
+    proses (import ulang script) lebih mahal dari parsing-nya sendiri.
+    """
+    max_workers = max(1, min(len(inverter_contents), os.cpu_count() or 1))
+    total_bytes = sum(len(data) for data in inverter_contents)
+    if max_workers == 1 or total_bytes < PARALLEL_LOAD_MIN_BYTES:
+        return [load_inverter_data_bytes(data) for data in inverter_contents]
+
+    # Jangan fork: fork dari proses Streamlit yang multi-thread bisa deadlock
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context(start_method)) as executor:
+        return list(executor.map(load_inverter_data_bytes, inverter_contents))
 
 # ================================
 # Bagian Aplikasi Streamlit
@@ -155,17 +298,23 @@ def main():
         # Pastikan file ada
         if (em_file is not None) and (rm_file is not None):
             # 2. Load Data
-            with st.spinner("Mengupload & memproses data EM..."):
-                df_em = load_sensor_data_em(em_file)
-            with st.spinner("Mengupload & memproses data RM..."):
-                df_rm = load_revenue_meter_data_rm(rm_file)
+            try:
+                with st.spinner("Mengupload & memproses data EM..."):
+                    df_em = load_sensor_data_em(em_file)
+                with st.spinner("Mengupload & memproses data RM..."):
+                    df_rm = load_revenue_meter_data_rm(rm_file)
+            except ValueError as e:
+                st.error(f"Gagal memproses file EM/RM: {e}")
+                return
             
             st.success("Data EM & RM berhasil diproses.")
 
-            # 3. Hitung PR - Tahap 1
-            merged_data = calculate_performance_ratio(df_em, df_rm, PV_CAPACITY, PR_THRESHOLD)
-            # 4. Identifikasi Masalah - Tahap 2
-            merged_data = identify_performance_issues(merged_data, PR_THRESHOLD)
+            # 3 & 4. Hitung PR (Tahap 1) & Identifikasi Masalah (Tahap 2)
+            em_rm_digest = upload_digest(em_file.getvalue(), rm_file.getvalue())
+            merged_data = compute_pr_and_issues(df_em, df_rm, em_rm_digest, PV_CAPACITY, PR_THRESHOLD)
+            if merged_data.empty:
+                st.error("Tidak ada 'Start Time' yang sama antara data EM & RM.")
+                return
 
             # Tampilkan ringkasan
             st.subheader("Ringkasan Hasil (Tahap 1 & 2)")
@@ -174,27 +323,28 @@ def main():
             
             # Statistik PR
             st.write("**Statistik PR**:")
-            st.write(merged_data['PR'].describe())
+            st.write(describe_pr(merged_data['PR'].to_numpy()))
             
             # Visualisasi PR (misalnya plot seiring waktu)
             st.write("**Grafik PR vs. Waktu**")
-            # Pastikan 'Start Time' terbaca sebagai datetime jika ingin plot
-            # (Tergantung format data aslinya)
-            # Jika 'Start Time' bukan format datetime, konversi:
-            merged_data['Start Time'] = pd.to_datetime(merged_data['Start Time'], errors='coerce')
-            
+            # 'Start Time' sudah dikonversi ke datetime saat load data.
+            # Data 5 menit di-resample dulu supaya titik yang dikirim ke browser sedikit
+            pr_plot = (merged_data.set_index('Start Time')['PR']
+                       .resample(PR_PLOT_FREQ).mean().reset_index())
             fig_pr_time = px.line(
-                merged_data.sort_values('Start Time'),
+                pr_plot,
                 x='Start Time',
                 y='PR',
-                title='Performance Ratio (PR) over Time'
+                title='Performance Ratio (PR) over Time',
+                render_mode='webgl'
             )
             st.plotly_chart(fig_pr_time, use_container_width=True)
             
             # Pie chart atau bar chart untuk status:
             st.write("**Distribusi Performance Status**")
-            status_count = merged_data['Performance Status'].value_counts().reset_index()
-            status_count.columns = ['Status', 'Count']
+            # Kolom status & masalah bertipe Categorical: groupby cukup menghitung kode kategori
+            status_count = (merged_data.groupby('Performance Status', observed=True).size()
+                            .rename_axis('Status').reset_index(name='Count'))
             fig_status = px.bar(
                 status_count, x='Status', y='Count', 
                 title='Jumlah Data Good vs Needs Attention',
@@ -204,8 +354,11 @@ def main():
             
             # Pie chart Indikasi Masalah
             st.write("**Indikasi Masalah** (untuk PR yang < 0.75)")
-            issue_count = merged_data[merged_data['PR'] < PR_THRESHOLD]['Indikasi Masalah'].value_counts().reset_index()
-            issue_count.columns = ['Issue', 'Count']
+            # Kode kategori > 0 = ada indikasi masalah (PR < threshold, dari kernel)
+            low_pr = merged_data['Indikasi Masalah'].cat.codes.to_numpy() > 0
+            low_pr_issues = merged_data['Indikasi Masalah'][low_pr]
+            issue_count = (low_pr_issues.groupby(low_pr_issues, observed=True).size()
+                           .rename_axis('Issue').reset_index(name='Count'))
             fig_issue = px.pie(issue_count, values='Count', names='Issue', title='Indikasi Masalah PR Rendah')
             st.plotly_chart(fig_issue, use_container_width=True)
 
@@ -213,15 +366,22 @@ def main():
             # 5. Analisis Inverter - Tahap 3
             # ----------------------------------------
             if inverter_files:
-                inverter_df_list = []
-                for inv_file in inverter_files:
-                    inv_data = load_inverter_data(inv_file)
-                    # Gunakan nama file nya untuk identifikasi
-                    inverter_df_list.append((inv_data, inv_file.name))
+                try:
+                    inverter_contents = tuple(f.getvalue() for f in inverter_files)
+                    inverter_data = load_inverter_files(inverter_contents)
+                except ValueError as e:
+                    st.error(f"Gagal memproses file inverter: {e}")
+                    return
+                # Gunakan nama file nya untuk identifikasi
+                inverter_df_list = list(zip(inverter_data, [f.name for f in inverter_files]))
                 
                 # Jalankan analisis
                 with st.spinner("Menganalisis data inverter..."):
+                    # Nama file ikut jadi kunci karena muncul di tabel ringkasan
+                    inverter_digest = (em_rm_digest, upload_digest(*inverter_contents),
+                                       tuple(f.name for f in inverter_files))
                     inverter_summary = analyze_inverter_performance(merged_data, inverter_df_list,
+                                                                    inverter_digest,
                                                                     pv_capacity=PV_CAPACITY,
                                                                     eff_threshold=INVERTER_EFF_THRESHOLD)
                 st.success("Analisis Inverter Selesai.")